@@ -12,12 +12,27 @@ TT1 - Route & ETA Chatbot (MVP)
 Author: Nguyen Minh Anh
 """
 
+import asyncio
+import hashlib
 import logging
 import os
 import re
+import time
+import unicodedata
+from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional, Tuple
-
-import requests
+from urllib.parse import quote_plus, urlencode
+
+import diskcache
+import httpx
+from cachetools import TTLCache
+
+# orjson is the fast path; fall back to stdlib json when it isn't installed.
+# Both raise ValueError subclasses on bad input and both accept bytes.
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # pragma: no cover
+    from json import loads as _json_loads
 from dotenv import load_dotenv
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
@@ -33,10 +48,15 @@ from telegram.ext import (
 # =========================
 # Logging
 # =========================
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
+# Only configure the root logger if nothing else has (re-imports, tests):
+# basicConfig would otherwise stack duplicate handlers.
+# Policy: log with lazy %-style args, never pre-formatted f-strings, so the
+# message is only rendered when the level is actually enabled.
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
@@ -58,6 +78,7 @@ FROM_TEXT, FROM_PICK, TO_TEXT, TO_PICK, MODE = range(5)
 # =========================
 NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
 OSRM_URL = "https://router.project-osrm.org/route/v1/driving"
+OSRM_TABLE_URL = "https://router.project-osrm.org/table/v1/driving"
 
 # NOTE: Keep your viewbox as you have "chốt" (we'll handle ordering later if needed)
 VIEWBOX_TPHCM = "106.3567007,10.1399458,107.0276712,11.1603083"
@@ -68,71 +89,309 @@ ACCEPT_LANGUAGE = "vi"
 # User-Agent required by Nominatim usage policy
 USER_AGENT = "tt1-route-bot/1.0 (demo; contact: nguyenminhanh56hv@gmail.com)"
 
+# Constant part of the Nominatim query; only "q" changes per call.
+# Kept as a tuple of pairs so the encoded query-string ordering is stable
+# (cache-friendly for any upstream proxy) and nothing is rebuilt per call.
+_NOM_BASE_PARAMS = (
+    ("format", "jsonv2"),
+    ("limit", str(LIMIT)),
+    ("addressdetails", "1"),
+    ("countrycodes", COUNTRY_CODES),
+    ("accept-language", ACCEPT_LANGUAGE),
+    ("viewbox", VIEWBOX_TPHCM),
+    ("bounded", "1"),
+)
+
+# The constant part url-encoded once at import; per call we only need to
+# quote "q" and concatenate, skipping the query-string encoder entirely.
+_NOM_SUFFIX = "&" + urlencode(_NOM_BASE_PARAMS)
+
+# We only need distance/duration, so tell OSRM to skip every optional
+# payload (geometry, steps, per-segment annotations, alternative routes)
+# instead of serializing arrays we'd just throw away.
+_OSRM_PARAMS = (
+    ("overview", "false"),
+    ("alternatives", "false"),
+    ("steps", "false"),
+    ("annotations", "false"),
+)
+
+# =========================
+# Shared HTTP client
+# =========================
+# Stage-specific timeouts: fail fast on dead endpoints (connect just above
+# the TCP SYN retransmit) while slow-but-alive servers keep a full read
+# budget, instead of one 12s wall clock that a bad handshake could eat.
+_CONNECT_TIMEOUT = 3.05
+_READ_TIMEOUT = 9.0
+
+# One AsyncClient for the whole bot: keep-alive reuses TCP/TLS connections
+# across requests, and async calls don't block the event loop, so concurrent
+# users' geocode/route calls overlap instead of queueing behind each other.
+# http2: concurrent calls to the same host multiplex over one TLS connection
+# instead of opening one socket each (needs the h2 package, in requirements).
+HTTP = httpx.AsyncClient(
+    timeout=httpx.Timeout(_READ_TIMEOUT, connect=_CONNECT_TIMEOUT),
+    headers={
+        "User-Agent": USER_AGENT,
+        "Accept": "application/json",
+        # JSON full of repeated Vietnamese address tokens compresses well;
+        # brotli (requirements) lets the servers negotiate "br"
+        "Accept-Encoding": "gzip, deflate, br",
+    },
+    # retries covers transient connect failures; failed GETs surface as
+    # usual and are handled per-call
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+    ),
+)
+
+
+async def close_http_client(application: Application) -> None:
+    """post_shutdown hook: close the shared AsyncClient cleanly."""
+    await HTTP.aclose()
+
+# =========================
+# In-process caches
+# =========================
+# Repeated queries (retries, popular POIs) should not pay a full network RTT
+# every time — and the Nominatim usage policy asks clients to cache results.
+# Geocode entries live 24h; routes are deterministic short-term, so 1h.
+_GEO_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=24 * 3600)
+_OSRM_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+_CACHE_LOCK = asyncio.Lock()
+
+# Negative cache: queries known to return nothing (typos, partial input)
+# short-circuit to [] without touching the disk layer or the network.
+# A TTL set rather than a bloom filter: no false positives that would
+# silently blank a real place, and 8k keys is tiny anyway.
+_GEO_EMPTY_CACHE: TTLCache = TTLCache(maxsize=8192, ttl=3600)
+
+# L2: persistent on-disk geocode cache — survives restarts, so popular
+# queries never re-hit Nominatim after a redeploy. Empty results are kept
+# too, with a short TTL, to suppress repeat lookups of dead queries.
+_GEO_DISK_CACHE = diskcache.Cache("./.cache/nominatim", size_limit=512 << 20)
+_GEO_DISK_TTL = 7 * 86400
+_GEO_DISK_EMPTY_TTL = 3600
+
+
+def _geo_disk_key(norm_q: str) -> str:
+    """Disk key covers every param that shapes the result, not just q."""
+    raw = f"{norm_q}|{COUNTRY_CODES}|{VIEWBOX_TPHCM}|{ACCEPT_LANGUAGE}|{LIMIT}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+# In-flight dedup: concurrent identical queries (several users typing the
+# same POI) await one shared task instead of each going to the network.
+_GEO_PENDING: Dict[str, "asyncio.Task[List[Dict[str, Any]]]"] = {}
+
+
+# =========================
+# Upstream rate limits
+# =========================
+class _AsyncRateLimiter:
+    """
+    Async context manager that spaces calls at least 1/rate seconds apart.
+    Slots are reserved under a lock, the wait happens outside it, so
+    concurrent callers queue fairly instead of bursting.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self._interval = 1.0 / rate
+        self._lock = asyncio.Lock()
+        self._next_at = 0.0
+
+    async def __aenter__(self) -> "_AsyncRateLimiter":
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            start = max(now, self._next_at)
+            self._next_at = start + self._interval
+        if start > now:
+            await asyncio.sleep(start - now)
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        return None
+
+
+# Public Nominatim policy: max 1 request/second. OSRM demo handles a few
+# parallel requests fine, so just cap the fan-out. Both knobs are
+# env-tunable so a self-hosted mirror (no public-policy limit) can unlock
+# real parallelism without code changes.
+NOMINATIM_RATE = float(os.getenv("NOMINATIM_RATE", "1.0"))
+OSRM_MAX_CONCURRENCY = int(os.getenv("OSRM_MAX_CONCURRENCY", "4"))
+
+_NOM_GATE = _AsyncRateLimiter(rate=NOMINATIM_RATE)
+_OSRM_GATE = asyncio.Semaphore(OSRM_MAX_CONCURRENCY)
+
+# Per-user throttle: one fast-typing (or abusive) user must not monopolize
+# the shared 1 rps Nominatim budget and push everyone into 429s.
+_USER_LAST_GEOCODE: Dict[int, float] = {}
+_USER_THROTTLE_GC_EVERY = 1000
+_user_throttle_calls = 0
+
+
+async def _throttle_user(user_id: Optional[int]) -> None:
+    """Delay so a single user sends at most ~1 geocode per second."""
+    global _user_throttle_calls
+
+    if user_id is None:
+        return
+
+    now = time.monotonic()
+    last = _USER_LAST_GEOCODE.get(user_id)
+    if last is not None and now - last < 1.0:
+        await asyncio.sleep(1.0 - (now - last))
+        now = time.monotonic()
+    _USER_LAST_GEOCODE[user_id] = now
+
+    # Occasionally drop entries idle for >60s so the dict can't grow forever
+    _user_throttle_calls += 1
+    if _user_throttle_calls % _USER_THROTTLE_GC_EVERY == 0:
+        cutoff = now - 60.0
+        for uid in [uid for uid, ts in _USER_LAST_GEOCODE.items() if ts < cutoff]:
+            del _USER_LAST_GEOCODE[uid]
+
+
+def _geo_cache_key(q: str) -> str:
+    """Normalize a query for caching (unicode-normalized, case-insensitive)."""
+    return unicodedata.normalize("NFKC", q).casefold()
+
+
+def _q5(x: Any) -> float:
+    """Quantize a coord (str or float) to 5 decimals (~1m)."""
+    return round(float(x), 5)
+
+
+def _osrm_cache_key(
+    from_coord: Tuple[str, str], to_coord: Tuple[str, str]
+) -> Tuple[float, float, float, float]:
+    """
+    Cache key for a route, quantized to ~1m: coords that differ only by
+    GPS-level noise hit the same entry. Key-only — the request URL still
+    carries the full-precision strings.
+    """
+    return (_q5(from_coord[0]), _q5(from_coord[1]), _q5(to_coord[0]), _q5(to_coord[1]))
+
 # =========================
-# Context helpers (10 keys)
+# Context (per-user flow state)
 # =========================
+@dataclass(slots=True)
+class RouteCtx:
+    """
+    Flow state for one user, stored under context.user_data["ctx"].
+    slots=True keeps per-user memory at fixed attribute slots instead of a
+    10-key dict — cheaper per user and cheaper to reset.
+    """
+
+    from_text: Optional[str] = None
+    from_candidates: List[Dict[str, Any]] = field(default_factory=list)
+    from_coord: Optional[Tuple[str, str]] = None    # Nominatim's (lat, lon) strings
+    from_label: Optional[str] = None
+    to_text: Optional[str] = None
+    to_candidates: List[Dict[str, Any]] = field(default_factory=list)
+    to_coord: Optional[Tuple[str, str]] = None      # Nominatim's (lat, lon) strings
+    to_label: Optional[str] = None
+    mode: Optional[str] = None                      # set ONLY after user chooses CAR or SKIP
+    route_result: Optional[Dict[str, Any]] = None   # optional cache
+
+    def clear_from(self) -> None:
+        self.from_text = None
+        self.from_candidates = []
+        self.from_coord = None
+        self.from_label = None
+
+    def clear_to(self) -> None:
+        self.to_text = None
+        self.to_candidates = []
+        self.to_coord = None
+        self.to_label = None
+
+
 def init_context(user_data: Dict[str, Any]) -> None:
-    """Reset context.user_data to default (10 keys)."""
+    """Reset context.user_data to a fresh RouteCtx."""
     user_data.clear()
-    user_data.update(
-        {
-            "from_text": None,
-            "from_candidates": [],
-            "from_coord": None,
-            "from_label": None,
-            "to_text": None,
-            "to_candidates": [],
-            "to_coord": None,
-            "to_label": None,
-            "mode": None,         # set ONLY after user chooses CAR or SKIP
-            "route_result": None, # optional cache
-        }
-    )
+    user_data["ctx"] = RouteCtx()
+
 
-def clear_from(user_data: Dict[str, Any]) -> None:
-    user_data["from_text"] = None
-    user_data["from_candidates"] = []
-    user_data["from_coord"] = None
-    user_data["from_label"] = None
+def get_ctx(user_data: Dict[str, Any]) -> RouteCtx:
+    """Fetch the RouteCtx, creating one defensively if missing."""
+    ctx = user_data.get("ctx")
+    if ctx is None:
+        ctx = user_data["ctx"] = RouteCtx()
+    return ctx
+
+# =========================
+# Constant keyboard pieces
+# =========================
+# InlineKeyboardButton is immutable in ptb v20+, so the fixed buttons can be
+# built once and reused across every keyboard render.
+# With LIMIT=3 there are only 2*LIMIT distinct PICK callback strings;
+# pre-build them instead of f-string formatting on every keyboard render.
+_PICK_FROM = tuple(f"PICK_FROM_{i}" for i in range(LIMIT))
+_PICK_TO = tuple(f"PICK_TO_{i}" for i in range(LIMIT))
+
+_BACK_FROM_ROW = [InlineKeyboardButton("Nhập lại", callback_data="BACK_FROM")]
+_BACK_TO_ROW = [InlineKeyboardButton("Nhập lại", callback_data="BACK_TO")]
+_MODE_KEYBOARD = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton("🚗 Ô tô", callback_data="MODE_CAR"),
+            InlineKeyboardButton("⏭️ Bỏ qua (mặc định Ô tô)", callback_data="MODE_SKIP"),
+        ],
+    ]
+)
+
+
+# =========================
+# Constant message templates
+# =========================
+# /start and /help are pure constants; the result message only varies in
+# its substituted fields. Building them once avoids re-concatenating the
+# literals on every command under concurrent bursts.
+_START_MSG = (
+    "👋 *Xin chào!*\n"
+    "Mình là bot hỗ trợ tìm đường và ước tính thời gian đến (ETA) tại TPHCM.\n\n"
+    "📌 *Cách dùng nhanh:*\n"
+    "- Gõ /route để bắt đầu\n"
+    "- Gõ /help để xem hướng dẫn\n"
+    "- Khi đang thao tác, gõ /cancel để hủy"
+)
+
+_HELP_MSG = (
+    "📖 *Hướng dẫn sử dụng*\n"
+    "  1. Gõ /route để bắt đầu\n"
+    "  2. Nhập điểm đi bằng chữ (ví dụ: tên địa điểm, số nhà,…)\n"
+    "  3. Chọn điểm đi từ danh sách gợi ý\n"
+    "  4. Nhập điểm đến và chọn điểm đến\n"
+    "  5. Chọn phương tiện (hiện tại: Ô tô) và nhận kết quả\n\n"
+    " *Ghi chú:*\n"
+    "- ETA là thời gian ước tính dựa trên hệ thống định tuyến (OSRM)\n"
+    "- Gõ /cancel để hủy thao tác bất kỳ lúc nào"
+)
+
+_RESULT_TMPL = (
+    "✅ *Tuyến đường*\n"
+    "{a} → {b}\n\n"
+    "📐 *{km:.1f} km*   ⏱️ *{mins} phút*\n"
+    "🗺️ [Mở chỉ đường trên OSM]({link})\n\n"
+    "🔁 Gõ /route để tìm tuyến khác hoặc /help"
+)
 
-def clear_to(user_data: Dict[str, Any]) -> None:
-    user_data["to_text"] = None
-    user_data["to_candidates"] = []
-    user_data["to_coord"] = None
-    user_data["to_label"] = None
 
 # =========================
 # Commands (outside flow)
 # =========================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """/start - intro (outside flow)."""
-    await update.message.reply_text(
-        "👋 *Xin chào!*\n"
-        "Mình là bot hỗ trợ tìm đường và ước tính thời gian đến (ETA) tại TPHCM.\n\n"
-        "📌 *Cách dùng nhanh:*\n"
-        "- Gõ /route để bắt đầu\n"
-        "- Gõ /help để xem hướng dẫn\n"
-        "- Khi đang thao tác, gõ /cancel để hủy"
-        ,
-        parse_mode="Markdown"
-    )
+    await update.message.reply_text(_START_MSG, parse_mode="Markdown")
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """/help - detailed guide (outside flow)."""
-    await update.message.reply_text(
-        "📖 *Hướng dẫn sử dụng*\n"
-        "  1. Gõ /route để bắt đầu\n"
-        "  2. Nhập điểm đi bằng chữ (ví dụ: tên địa điểm, số nhà,…)\n"
-        "  3. Chọn điểm đi từ danh sách gợi ý\n"
-        "  4. Nhập điểm đến và chọn điểm đến\n"
-        "  5. Chọn phương tiện (hiện tại: Ô tô) và nhận kết quả\n\n"
-        " *Ghi chú:*\n"
-        "- ETA là thời gian ước tính dựa trên hệ thống định tuyến (OSRM)\n"
-        "- Gõ /cancel để hủy thao tác bất kỳ lúc nào"
-        ,
-        parse_mode="Markdown"
-    )
+    await update.message.reply_text(_HELP_MSG, parse_mode="Markdown")
 
 
 
@@ -157,7 +416,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 # =========================
 # Services placeholders
 # =========================
-def geocode_nominatim(query: str) -> List[Dict[str, Any]]:
+async def geocode_nominatim(query: str) -> List[Dict[str, Any]]:
     """
     Call Nominatim with fixed params:
       q=<query>
@@ -169,57 +428,91 @@ def geocode_nominatim(query: str) -> List[Dict[str, Any]]:
       viewbox=... (TPHCM)
       bounded=1
 
-    Return raw JSON list (may be empty).
+    Return the normalized Candidate list (may be empty) — raw items are
+    parsed in the same pass, so callers never touch the Nominatim JSON.
     """
-    # TODO: implement: requests.get + params + headers(User-Agent)
-
     q = (query or "").strip()
     if not q:
         return []
-    
-    params = {
-        "q": q,
-        "format": "jsonv2",
-        "limit": str(LIMIT),
-        "addressdetails": "1",
-        "countrycodes": COUNTRY_CODES,
-        "accept-language": ACCEPT_LANGUAGE,
-        "viewbox": VIEWBOX_TPHCM,
-        "bounded": "1",
-    }
 
-    headers = {
-        "User-Agent": USER_AGENT,
-        "Accept": "application/json",
-    }
+    cache_key = _geo_cache_key(q)
+    async with _CACHE_LOCK:
+        if cache_key in _GEO_EMPTY_CACHE:
+            return []
+        cached = _GEO_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # L2: on-disk (empty list is a valid, deliberately cached answer)
+    disk_key = _geo_disk_key(cache_key)
+    cached = _GEO_DISK_CACHE.get(disk_key)
+    if cached is not None:
+        async with _CACHE_LOCK:
+            if cached:
+                _GEO_CACHE[cache_key] = cached
+            else:
+                _GEO_EMPTY_CACHE[cache_key] = True
+        return cached
+
+    # Coalesce: if the same query is already on the wire, await that task
+    async with _CACHE_LOCK:
+        task = _GEO_PENDING.get(cache_key)
+        owner = task is None
+        if owner:
+            task = asyncio.create_task(_geocode_fetch(q, cache_key, disk_key))
+            _GEO_PENDING[cache_key] = task
+    try:
+        return await task
+    finally:
+        if owner:
+            async with _CACHE_LOCK:
+                _GEO_PENDING.pop(cache_key, None)
+
+
+async def _geocode_fetch(q: str, cache_key: str, disk_key: str) -> List[Dict[str, Any]]:
+    """The actual Nominatim request + parse + cache fill (one per unique query)."""
+    url = NOMINATIM_URL + "?q=" + quote_plus(q) + _NOM_SUFFIX
 
     try:
-        resp = requests.get(
-            NOMINATIM_URL,
-            params=params,
-            headers=headers,
-            timeout=12,  # seconds
-        )
+        async with _NOM_GATE:
+            resp = await HTTP.get(url)
         resp.raise_for_status()
 
-        data = resp.json()
-        if isinstance(data, list):
-            return data
+        # orjson (when available) decodes the raw bytes ~3-5x faster than
+        # stdlib json — matters for the Vietnamese-heavy Nominatim payloads.
+        data = _json_loads(resp.content)
+        # Exact type check: the decoder only ever yields plain list/dict,
+        # and `type is` skips isinstance's subclass walk on the hot path
+        if type(data) is list:
+            candidates = _parse_candidates(data)
+            # L1 keeps only real hits; the disk layer also keeps empties
+            # (short TTL) so dead queries stop re-hitting the network
+            async with _CACHE_LOCK:
+                if candidates:
+                    _GEO_CACHE[cache_key] = candidates
+                else:
+                    _GEO_EMPTY_CACHE[cache_key] = True
+            _GEO_DISK_CACHE.set(
+                disk_key,
+                candidates,
+                expire=_GEO_DISK_TTL if candidates else _GEO_DISK_EMPTY_TTL,
+            )
+            return candidates
 
         # Defensive: if API returns non-list for some reason
         logger.warning("Nominatim unexpected JSON type: %s", type(data))
         return []
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.warning("Nominatim timeout for query=%r", q)
         return []
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         # 429 (Too Many Requests) can happen on public Nominatim
         status = getattr(e.response, "status_code", None)
         logger.warning("Nominatim HTTPError status=%s query=%r", status, q)
         return []
-    except requests.exceptions.RequestException as e:
-        logger.warning("Nominatim RequestException query=%r err=%s", q, e)
+    except httpx.HTTPError as e:
+        logger.warning("Nominatim HTTPError query=%r err=%s", q, e)
         return []
     except ValueError as e:
         # JSON decode error
@@ -227,13 +520,34 @@ def geocode_nominatim(query: str) -> List[Dict[str, Any]]:
         return []
 
 
+async def geocode_many(queries: List[str]) -> List[List[Dict[str, Any]]]:
+    """
+    Geocode several queries concurrently with asyncio.gather.
+    Safe to fan out: cache hits return immediately and real requests are
+    spaced by the shared 1 rps gate, so wall time is bounded by the policy,
+    not by serial round-trips.
+    """
+    return list(await asyncio.gather(*(geocode_nominatim(q) for q in queries)))
+
+
+# Beautify replacements applied to every label: one precompiled alternation
+# so the string is scanned (and reallocated) once instead of once per rule.
+_BEAUTIFY_MAP = {"Phường ": "P. ", "Khu phố ": "KP ", "Đường ": ""}
+_BEAUTIFY_RE = re.compile("|".join(map(re.escape, _BEAUTIFY_MAP)))
+
+
+def _g(d: Dict[str, Any], k: str) -> str:
+    """Stripped string field of d, or "" — replaces the (get or "").strip() chains."""
+    v = d.get(k)
+    return v.strip() if isinstance(v, str) else ""
+
+
 def build_label(raw_item: Dict[str, Any]) -> str:
     """
     Build short label from raw_item using FINAL rule (name/display_name + addressdetails parts).
     """
-    # TODO: implement FINAL label rule
-    name = (raw_item.get("name") or "").strip()
-    display_name = (raw_item.get("display_name") or "").strip()
+    name = _g(raw_item, "name")
+    display_name = _g(raw_item, "display_name")
 
     if name:
         base_name = name
@@ -249,37 +563,19 @@ def build_label(raw_item: Dict[str, Any]) -> str:
     if not isinstance(address, dict):
         address = {}
 
-    parts: List[str] = []
-
-    # ---- Part 1: house_number + road ----
-    hn = (address.get("house_number") or "").strip()
-    road = (address.get("road") or "").strip()
+    # ---- Parts: house_number + road, neighbourhood, suburb ----
+    hn = _g(address, "house_number")
+    road = _g(address, "road")
 
     # Drop road if it duplicates base_name (exact match as you chốt)
-    if road and road == base_name:
+    if road == base_name:
         road = ""
-    
-    part1 = ""
-    if hn and road:
-        part1 = f"{hn} {road}"
-    elif hn and not road:
-        part1 = hn
-    elif (not hn) and road:
-        part1 = road
-    
-    if part1.strip():
-        parts.append(part1.strip())
-
-    # ---- Part 2: neighbourhood ----
-    nb = (address.get("neighbourhood") or "").strip()
-    if nb:
-        parts.append(nb)
-
-    # ---- Part 3: suburb ----
-    sb = (address.get("suburb") or "").strip()
-    if sb:
-        parts.append(sb)
-    
+
+    # "hn road" covers all combos: .strip() trims the join when one is empty
+    part1 = f"{hn} {road}".strip() if (hn or road) else ""
+    parts = [s for s in (part1, _g(address, "neighbourhood"), _g(address, "suburb")) if s]
+
+
     # ---- Compose label (default N=3) ----
     if not parts:
         label = base_name
@@ -287,9 +583,7 @@ def build_label(raw_item: Dict[str, Any]) -> str:
         label = f"{base_name} — {', '.join(parts[:3])}"
 
     # ---- Beautify (final) ----
-    label = label.replace("Phường ", "P. ")
-    label = label.replace("Khu phố ", "KP ")
-    label = label.replace("Đường ", "")
+    label = _BEAUTIFY_RE.sub(lambda m: _BEAUTIFY_MAP[m.group(0)], label)
 
     # Optional: collapse multiple spaces after replacements
     # label = " ".join(label.split()).strip()
@@ -302,123 +596,192 @@ def build_label(raw_item: Dict[str, Any]) -> str:
     return label
 
 
-def normalize_candidates(raw_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+# Labels only depend on the Nominatim item, so memoize them per OSM object.
+# Plain dict with FIFO eviction (insertion order) — no TTL needed, labels
+# for a given place don't change within a bot run.
+_LABEL_CACHE: Dict[Tuple[Any, Any, Any], str] = {}
+_LABEL_CACHE_MAX = 4096
+
+
+def _label_for(item: Dict[str, Any]) -> str:
+    """build_label with a per-(place_id, osm_type, osm_id) memo."""
+    key = (item.get("place_id"), item.get("osm_type"), item.get("osm_id"))
+    if key[0] is None:
+        # No stable identity -> don't cache
+        return build_label(item)
+
+    label = _LABEL_CACHE.get(key)
+    if label is None:
+        label = build_label(item)
+        if len(_LABEL_CACHE) >= _LABEL_CACHE_MAX:
+            _LABEL_CACHE.pop(next(iter(_LABEL_CACHE)))
+        _LABEL_CACHE[key] = label
+    return label
+
+
+# Validates Nominatim coord strings up front, so the parse loop can call
+# float() bare instead of arming a try/except frame per item.
+_FLOAT_RE = re.compile(r"^-?\d+(?:\.\d+)?$", re.ASCII)
+
+
+def _candidate(item: Dict[str, Any], lat_str: str, lon_str: str) -> Dict[str, Any]:
+    """Build one Candidate from a raw item with prevalidated coord strings."""
+    display_name = _g(item, "display_name")
+    label = _label_for(item).strip()
+
+    if not label:
+        label = (display_name.partition(",")[0].strip() if display_name else "Không rõ")
+
+    return {
+        "lat": float(lat_str),
+        "lon": float(lon_str),
+        "lat_str": lat_str,
+        "lon_str": lon_str,
+        "label": label,
+        "display_name": display_name,
+    }
+
+
+def _parse_candidates(raw_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Convert raw Nominatim items -> Candidate objects (top LIMIT items):
     Candidate = {
         "lat": float,
         "lon": float,
+        "lat_str": str,   # Nominatim's original strings, reused verbatim
+        "lon_str": str,   # when building OSRM/OSM URLs (no float round-trip)
         "label": str,
         "display_name": str
     }
 
-    Assumptions:
-    - raw_list is a list returned by geocode_nominatim()
-    - build_label(raw_item) already applies N=3 and beautify
+    Called from the success branch of geocode_nominatim, so raw items are
+    normalized in the same pass as the response parse. Coords are checked
+    with _FLOAT_RE first, so the comprehension itself runs without
+    per-item exception handling; one outer try keeps the defense.
     """
-    # TODO: implement: parse lat/lon float + label + display_name
-    candidates: List[Dict[str, Any]] = []
-    if not raw_list:
-        return candidates
+    try:
+        return [
+            _candidate(item, lat, lon)
+            for item in (raw_list or [])
+            for lat in (item.get("lat"),)
+            for lon in (item.get("lon"),)
+            if isinstance(lat, str)
+            and isinstance(lon, str)
+            and _FLOAT_RE.match(lat)
+            and _FLOAT_RE.match(lon)
+        ]
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning("Candidate parse failed err=%s", e)
+        return []
 
-    for item in raw_list:
-        try:
-            lat_str = item.get("lat")
-            lon_str = item.get("lon")
-            if lat_str is None or lon_str is None:
-                continue
-
-            lat = float(lat_str)
-            lon = float(lon_str)
-
-            display_name = (item.get("display_name") or "").strip()
-            label = build_label(item).strip()
-
-            if not label:
-                label = (display_name.split(",")[0].strip() if display_name else "Không rõ")
-
-            candidates.append(
-                {
-                    "lat": lat,
-                    "lon": lon,
-                    "label": label,
-                    "display_name": display_name,
-                }
-            )
-        except (ValueError, TypeError):
-            continue
 
-    return candidates
+def _osrm_coord_path(coords: List[Tuple[str, str]]) -> str:
+    """Join (lat, lon) coords into OSRM's lon,lat;lon,lat URL segment."""
+    return ";".join(f"{c[1]},{c[0]}" for c in coords)
 
 
-def osrm_route(from_coord: Tuple[float, float], to_coord: Tuple[float, float]) -> Dict[str, Any]:
+async def osrm_route(from_coord: Tuple[str, str], to_coord: Tuple[str, str]) -> Dict[str, Any]:
     """
     Call OSRM: /route/v1/driving/lon,lat;lon,lat?overview=false
     Return dict with distance_m, duration_s.
+
+    Coords are the (lat, lon) strings from the chosen Candidate — Nominatim
+    already emits full precision, so they go into the URL as-is.
     """
-    # TODO: implement OSRM request + parse routes[0]
-    from_lat, from_lon = from_coord
-    to_lat, to_lon = to_coord
+    cache_key = _osrm_cache_key(from_coord, to_coord)
+    async with _CACHE_LOCK:
+        cached = _OSRM_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
 
-    url = f"{OSRM_URL}/{from_lon},{from_lat};{to_lon},{to_lat}"
-    params = {
-        "overview": "false",
-    }
-    headers = {
-        "Accept": "application/json",
-        "User-Agent": USER_AGENT,  # not required by OSRM demo but harmless
-    }
+    url = f"{OSRM_URL}/{_osrm_coord_path([from_coord, to_coord])}"
 
     try:
-        resp = requests.get(url, params=params, headers=headers, timeout=12)
+        async with _OSRM_GATE:
+            resp = await HTTP.get(url, params=_OSRM_PARAMS)
         resp.raise_for_status()
-        data = resp.json()
+        data = _json_loads(resp.content)
 
-        routes = data.get("routes") or []
-        if not routes:
-            return {}
-
-        r0 = routes[0] or {}
-        distance_m = r0.get("distance")
-        duration_s = r0.get("duration")
-
-        if distance_m is None or duration_s is None:
+        # Pull routes[0].distance/duration directly; any missing piece
+        # (no route, malformed payload) lands in the except below.
+        try:
+            r0 = data["routes"][0]
+            result = {
+                "distance_m": float(r0["distance"]),
+                "duration_s": float(r0["duration"]),
+            }
+        except (KeyError, IndexError, TypeError):
+            logger.warning("OSRM response missing route data url=%s", url)
             return {}
+        async with _CACHE_LOCK:
+            _OSRM_CACHE[cache_key] = result
+        return result
 
-        return {
-            "distance_m": float(distance_m),
-            "duration_s": float(duration_s),
-        }
-
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.warning("OSRM timeout url=%s", url)
         return {}
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         status = getattr(e.response, "status_code", None)
         logger.warning("OSRM HTTPError status=%s url=%s", status, url)
         return {}
-    except requests.exceptions.RequestException as e:
-        logger.warning("OSRM RequestException url=%s err=%s", url, e)
+    except httpx.HTTPError as e:
+        logger.warning("OSRM HTTPError url=%s err=%s", url, e)
         return {}
     except ValueError as e:
         logger.warning("OSRM JSON decode error url=%s err=%s", url, e)
         return {}
 
 
-def build_osm_directions_link(from_coord: Tuple[float, float], to_coord: Tuple[float, float]) -> str:
+async def osrm_table(coords: List[Tuple[str, str]]) -> List[List[Optional[float]]]:
     """
-    Build OSM directions link:
-    https://www.openstreetmap.org/directions?engine=fossgis_osrm_car&route=lat1,lon1;lat2,lon2
+    Call OSRM /table/v1/driving for the N×N duration matrix (seconds) over
+    coords in ONE request — for multi-destination ETA queries this replaces
+    N×N individual route calls. Entries are None where OSRM found no route;
+    returns [] on error.
     """
-    # TODO: implement
-    from_lat, from_lon = from_coord
-    to_lat, to_lon = to_coord
+    if len(coords) < 2:
+        return []
+
+    url = f"{OSRM_TABLE_URL}/{_osrm_coord_path(coords)}"
+
+    try:
+        async with _OSRM_GATE:
+            resp = await HTTP.get(url)
+        resp.raise_for_status()
+        data = _json_loads(resp.content)
+
+        durations = data.get("durations")
+        if not isinstance(durations, list):
+            logger.warning("OSRM table missing durations url=%s", url)
+            return []
+        return durations
+
+    except httpx.TimeoutException:
+        logger.warning("OSRM table timeout url=%s", url)
+        return []
+    except httpx.HTTPStatusError as e:
+        status = getattr(e.response, "status_code", None)
+        logger.warning("OSRM table HTTPError status=%s url=%s", status, url)
+        return []
+    except httpx.HTTPError as e:
+        logger.warning("OSRM table HTTPError url=%s err=%s", url, e)
+        return []
+    except ValueError as e:
+        logger.warning("OSRM table JSON decode error url=%s err=%s", url, e)
+        return []
 
-    # Keep a reasonable precision for URLs
-    a = f"{from_lat:.6f},{from_lon:.6f}"
-    b = f"{to_lat:.6f},{to_lon:.6f}"
 
-    return f"https://www.openstreetmap.org/directions?engine=fossgis_osrm_car&route={a};{b}"
+def build_osm_directions_link(from_coord: Tuple[str, str], to_coord: Tuple[str, str]) -> str:
+    """
+    Build OSM directions link:
+    https://www.openstreetmap.org/directions?engine=fossgis_osrm_car&route=lat1,lon1;lat2,lon2
+
+    Coords are Nominatim's (lat, lon) strings, interpolated verbatim.
+    """
+    return (
+        "https://www.openstreetmap.org/directions?engine=fossgis_osrm_car&route="
+        f"{from_coord[0]},{from_coord[1]};{to_coord[0]},{to_coord[1]}"
+    )
 
 
 
@@ -430,21 +793,15 @@ def format_result_message(
     link: str,
 ) -> str:
     """Format final result message."""
-    # TODO: implement output template
-    a = from_label.split("—")[0].strip()
-    b = to_label.split("—")[0].strip()
+    # partition stops at the first "—" instead of splitting the whole label
+    a = from_label.partition("—")[0].strip()
+    b = to_label.partition("—")[0].strip()
 
     # Convert units
     distance_km = distance_m / 1000
     duration_min = round(duration_s / 60)
 
-    return (
-        f"✅ *Tuyến đường*\n"
-        f"{a} → {b}\n\n"
-        f"📐 *{distance_km:.1f} km*   ⏱️ *{duration_min} phút*\n"
-        f"🗺️ [Mở chỉ đường trên OSM]({link})\n\n"
-        f"🔁 Gõ /route để tìm tuyến khác hoặc /help"
-    )
+    return _RESULT_TMPL.format(a=a, b=b, km=distance_km, mins=duration_min, link=link)
 
 # =========================
 # State handlers
@@ -455,36 +812,36 @@ async def handle_from_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     - receive text as from_text
     - call geocode_nominatim(from_text)
       - if 0 results: ask user to enter again, keep FROM_TEXT
-      - if >=1: normalize_candidates -> save -> show inline keyboard -> FROM_PICK
+      - if >=1: save candidates -> show inline keyboard -> FROM_PICK
     """
-    # TODO: implement
     text = update.message.text.strip()
+    ctx = get_ctx(context.user_data)
 
     # Save user input
-    context.user_data["from_text"] = text
+    ctx.from_text = text
 
-    # Call Nominatim (already limited to 3)
-    raw_list = geocode_nominatim(text)
+    # Call Nominatim (already limited to 3, candidates come back normalized)
+    await _throttle_user(update.effective_user.id if update.effective_user else None)
+    candidates = await geocode_nominatim(text)
 
     # geocode = 0
-    if not raw_list:
-        context.user_data["from_candidates"] = []
+    if not candidates:
+        ctx.from_candidates = []
         await update.message.reply_text(
             "Không tìm thấy địa điểm. "
             "Bạn nhập rõ hơn nhé (VD: tên địa điểm, số nhà, đường, phường, quận, TP.HCM)."
         )
         return FROM_TEXT
-    
+
     # geocode >= 1
-    candidates = normalize_candidates(raw_list)
-    context.user_data["from_candidates"] = candidates
+    ctx.from_candidates = candidates
 
     # Show inline keyboard
     keyboard = [
-        [InlineKeyboardButton(c["label"], callback_data=f"PICK_FROM_{i}")]
+        [InlineKeyboardButton(c["label"], callback_data=_PICK_FROM[i])]
         for i, c in enumerate(candidates)
     ]
-    keyboard.append([InlineKeyboardButton("Nhập lại", callback_data="BACK_FROM")])
+    keyboard.append(_BACK_FROM_ROW)
 
     await update.message.reply_text(
         "Mình tìm thấy các địa điểm sau. Bạn chọn đúng điểm xuất phát:",
@@ -505,9 +862,10 @@ async def handle_from_pick(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     await q.answer()
 
     data = q.data or ""
+    ctx = get_ctx(context.user_data)
 
     if data == "BACK_FROM":
-        clear_from(context.user_data)
+        ctx.clear_from()
         # Ẩn keyboard cũ + báo nhập lại ngay trên message đó
         await q.edit_message_text("↩️ Ok, bạn nhập lại điểm xuất phát nhé.")
         await q.message.reply_text(
@@ -517,10 +875,10 @@ async def handle_from_pick(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     # data chắc chắn là PICK_FROM_i (do pattern)
     idx = int(data.split("_")[-1])
-    chosen = context.user_data["from_candidates"][idx]
+    chosen = ctx.from_candidates[idx]
 
-    context.user_data["from_coord"] = (chosen["lat"], chosen["lon"])
-    context.user_data["from_label"] = chosen["label"]
+    ctx.from_coord = (chosen["lat_str"], chosen["lon_str"])
+    ctx.from_label = chosen["label"]
 
     # 📍 collapse message chứa keyboard thành 1 dòng xác nhận
     await q.edit_message_text(f"📍 Đã chọn điểm xuất phát: {chosen['label']}")
@@ -538,20 +896,21 @@ async def handle_to_text(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     - receive text as to_text
     - call geocode_nominatim(to_text)
       - if 0 results: ask user to enter again, keep TO_TEXT
-      - if >=1: normalize_candidates -> save -> show inline keyboard -> TO_PICK
+      - if >=1: save candidates -> show inline keyboard -> TO_PICK
     """
-    # TODO: implement
     text = update.message.text.strip()
+    ctx = get_ctx(context.user_data)
 
     # Save user input
-    context.user_data["to_text"] = text
+    ctx.to_text = text
+
+    # Call Nominatim (already limited to 3, candidates come back normalized)
+    await _throttle_user(update.effective_user.id if update.effective_user else None)
+    candidates = await geocode_nominatim(text)
 
-    # Call Nominatim (already limited to 3)
-    raw_list = geocode_nominatim(text)
-    
     # geocode = 0
-    if not raw_list:
-        context.user_data["to_candidates"] = []
+    if not candidates:
+        ctx.to_candidates = []
         await update.message.reply_text(
             "Không tìm thấy địa điểm. "
             "Bạn nhập rõ hơn nhé (VD: tên địa điểm, số nhà, đường, phường, quận, TP.HCM)."
@@ -559,15 +918,14 @@ async def handle_to_text(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return TO_TEXT
 
     # geocode >= 1
-    candidates = normalize_candidates(raw_list)
-    context.user_data["to_candidates"] = candidates
+    ctx.to_candidates = candidates
 
     # Show inline keyboard
     keyboard = [
-        [InlineKeyboardButton(c["label"], callback_data=f"PICK_TO_{i}")]
+        [InlineKeyboardButton(c["label"], callback_data=_PICK_TO[i])]
         for i, c in enumerate(candidates)
     ]
-    keyboard.append([InlineKeyboardButton("Nhập lại", callback_data="BACK_TO")])
+    keyboard.append(_BACK_TO_ROW)
 
     await update.message.reply_text(
         "Mình tìm thấy các địa điểm sau. Bạn chọn đúng điểm đến:",
@@ -588,32 +946,29 @@ async def handle_to_pick(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await q.answer()
 
     data = q.data
+    ctx = get_ctx(context.user_data)
 
     if data == "BACK_TO":
-        clear_to(context.user_data)
+        ctx.clear_to()
         await q.edit_message_text("↩️ Ok, bạn nhập lại điểm đến nhé.")
         await q.message.reply_text("Bạn muốn đến đâu? (Nhập địa điểm đến)")
         return TO_TEXT
     
     # data chắc chắn là PICK_TO_i (do pattern)
     idx = int(data.split("_")[-1])
-    chosen = context.user_data["to_candidates"][idx]
+    chosen = ctx.to_candidates[idx]
 
-    context.user_data["to_coord"] = (chosen["lat"], chosen["lon"])  # (lat, lon)
-    context.user_data["to_label"] = chosen["label"]
+    ctx.to_coord = (chosen["lat_str"], chosen["lon_str"])  # (lat, lon)
+    ctx.to_label = chosen["label"]
 
     # 📍 collapse message chứa keyboard (ẩn nút)
     await q.edit_message_text(f"📍 Đã chọn điểm đến: {chosen['label']}")
 
 
     # MODE keyboard (demo: car only)
-    keyboard = [
-        [InlineKeyboardButton("🚗 Ô tô", callback_data="MODE_CAR"), InlineKeyboardButton("⏭️ Bỏ qua (mặc định Ô tô)", callback_data="MODE_SKIP")],
-    ]
-
     await q.message.reply_text(
         "🚦 Chọn phương tiện (bản demo hiện chỉ hỗ trợ Ô tô):",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=_MODE_KEYBOARD,
     )
     return MODE
 
@@ -631,9 +986,10 @@ async def handle_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     await q.answer()
 
     data = q.data  # MODE_CAR or MODE_SKIP
+    ctx = get_ctx(context.user_data)
 
     # Demo: both choices lead to car
-    context.user_data["mode"] = "car"
+    ctx.mode = "car"
 
     # Collapse the mode keyboard message
     if data == "MODE_CAR":
@@ -641,12 +997,12 @@ async def handle_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     else:
         await q.edit_message_text("Bỏ qua chọn phương tiện (mặc định 🚗)")
 
-    from_coord = context.user_data.get("from_coord")
-    to_coord = context.user_data.get("to_coord")
-    from_label = context.user_data.get("from_label") 
-    to_label = context.user_data.get("to_label") 
+    from_coord = ctx.from_coord
+    to_coord = ctx.to_coord
+    from_label = ctx.from_label
+    to_label = ctx.to_label
 
-    route = osrm_route(from_coord, to_coord)
+    route = await osrm_route(from_coord, to_coord)
     if not route:
         await q.message.reply_text(
             "Xin lỗi, mình không tính được lộ trình lúc này (OSRM lỗi/không có tuyến). "
@@ -659,7 +1015,7 @@ async def handle_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
     link = build_osm_directions_link(from_coord, to_coord)
 
-    context.user_data["route_result"] = {
+    ctx.route_result = {
         "distance_m": distance_m,
         "duration_s": duration_s,
         "link": link,
@@ -718,8 +1074,22 @@ async def handle_invalid_callback_mode(update: Update, context: ContextTypes.DEF
 # =========================
 # Build app
 # =========================
+# Callback data is ASCII-only, so compile the dispatch patterns once with
+# re.ASCII and skip the Unicode tables on every callback match.
+_PAT_FROM_PICK = re.compile(r"^(PICK_FROM_\d+|BACK_FROM)$", re.ASCII)
+_PAT_TO_PICK = re.compile(r"^(PICK_TO_\d+|BACK_TO)$", re.ASCII)
+_PAT_MODE = re.compile(r"^(MODE_CAR|MODE_SKIP)$", re.ASCII)
 def build_application() -> Application:
-    application = Application.builder().token(TOKEN).build()
+    # concurrent_updates: handle updates from different chats in parallel,
+    # so one user's slow Nominatim/OSRM call no longer blocks everyone else.
+    # The FSM stays safe: state lives in per-user context.user_data.
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(True)
+        .post_shutdown(close_http_client)
+        .build()
+    )
 
     # Global commands (outside flow)
     application.add_handler(CommandHandler("start", start))
@@ -734,23 +1104,24 @@ def build_application() -> Application:
                 MessageHandler(~filters.TEXT & ~filters.COMMAND, handle_non_text_from),
             ],
             FROM_PICK: [
-                CallbackQueryHandler(handle_from_pick, pattern=r"^(PICK_FROM_\d+|BACK_FROM)$"),
+                CallbackQueryHandler(handle_from_pick, pattern=_PAT_FROM_PICK),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_in_from_pick),
-                CallbackQueryHandler(handle_invalid_callback_from_pick, pattern=r"^.*$"),
+                # No pattern = match anything the handler above didn't take
+                CallbackQueryHandler(handle_invalid_callback_from_pick),
             ],
             TO_TEXT: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_to_text),
                 MessageHandler(~filters.TEXT & ~filters.COMMAND, handle_non_text_to),
             ],
             TO_PICK: [
-                CallbackQueryHandler(handle_to_pick, pattern=r"^(PICK_TO_\d+|BACK_TO)$"),
+                CallbackQueryHandler(handle_to_pick, pattern=_PAT_TO_PICK),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_in_to_pick),
-                CallbackQueryHandler(handle_invalid_callback_to_pick, pattern=r"^.*$"),
+                CallbackQueryHandler(handle_invalid_callback_to_pick),
             ],
             MODE: [
-                CallbackQueryHandler(handle_mode, pattern=r"^(MODE_CAR|MODE_SKIP)$"),
+                CallbackQueryHandler(handle_mode, pattern=_PAT_MODE),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_in_mode),
-                CallbackQueryHandler(handle_invalid_callback_mode, pattern=r"^.*$"),
+                CallbackQueryHandler(handle_invalid_callback_mode),
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
@@ -1,11 +1,15 @@
 # test.py
+import re
 from typing import Dict, Any, List
 
+# Beautify replacements: one precompiled alternation, single pass
+_BEAUTIFY_MAP = {"Phường ": "P. ", "Khu phố ": "KP ", "Đường ": ""}
+_BEAUTIFY_RE = re.compile("|".join(map(re.escape, _BEAUTIFY_MAP)))
+
 def build_label(raw_item: Dict[str, Any]) -> str:
     """
     Build short label from raw_item using FINAL rule (name/display_name + addressdetails parts).
     """
-    # TODO: implement FINAL label rule
     name = (raw_item.get("name") or "").strip()
     display_name = (raw_item.get("display_name") or "").strip()
 
@@ -61,9 +65,7 @@ def build_label(raw_item: Dict[str, Any]) -> str:
         label = f"{base_name} — {', '.join(parts[:3])}"
 
     # ---- Beautify (final) ----
-    label = label.replace("Phường ", "P. ")
-    label = label.replace("Khu phố ", "KP ")
-    label = label.replace("Đường ", "")
+    label = _BEAUTIFY_RE.sub(lambda m: _BEAUTIFY_MAP[m.group(0)], label)
 
     # Optional: collapse multiple spaces after replacements
     # label = " ".join(label.split()).strip()
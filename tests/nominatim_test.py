@@ -3,6 +3,9 @@ import requests
 import logging
 from typing import List, Dict, Any
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 # ======================
 # CONFIG
 # ======================
@@ -17,6 +20,42 @@ VIEWBOX_TPHCM = "106.3567007,10.1399458,107.0276712,11.1603083"
 
 USER_AGENT = "route-bot-test/1.0 (contact: nguyenminhanh56hv@gmail.com)"
 
+# ======================
+# SESSION (keep-alive + retry)
+# ======================
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+        ),
+    ),
+)
+_SESSION.headers.update(
+    {
+        "User-Agent": USER_AGENT,
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate, br",
+    }
+)
+
+# Constant part of the query; only "q" varies per call
+_BASE_PARAMS = {
+    "format": "jsonv2",
+    "limit": str(LIMIT),
+    "addressdetails": "1",
+    "countrycodes": COUNTRY_CODES,
+    "accept-language": ACCEPT_LANGUAGE,
+    "viewbox": VIEWBOX_TPHCM,
+    "bounded": "1",
+}
+
 # ======================
 # LOGGING
 # ======================
@@ -49,28 +88,13 @@ def geocode_nominatim(query: str) -> List[Dict[str, Any]]:
     if not q:
         return []
     
-    params = {
-        "q": q,
-        "format": "jsonv2",
-        "limit": str(LIMIT),
-        "addressdetails": "1",
-        "countrycodes": COUNTRY_CODES,
-        "accept-language": ACCEPT_LANGUAGE,
-        "viewbox": VIEWBOX_TPHCM,
-        "bounded": "1",
-    }
-
-    headers = {
-        "User-Agent": USER_AGENT,
-        "Accept": "application/json",
-    }
+    params = {"q": q, **_BASE_PARAMS}
 
     try:
-        resp = requests.get(
+        resp = _SESSION.get(
             NOMINATIM_URL,
             params=params,
-            headers=headers,
-            timeout=12,  # seconds
+            timeout=(3.05, 9),  # (connect, read) seconds
         )
         resp.raise_for_status()
 
@@ -3,12 +3,40 @@ import logging
 from typing import Tuple, Dict, Any
 import requests
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 # ======================
 # CONFIG
 # ======================
 OSRM_URL = "https://router.project-osrm.org/route/v1/driving"
 USER_AGENT = "osrm-test/1.0 (contact: test@example.com)"
 
+# ======================
+# SESSION (keep-alive + retry)
+# ======================
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+        ),
+    ),
+)
+_SESSION.headers.update(
+    {
+        "User-Agent": USER_AGENT,
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate, br",
+    }
+)
+
 # ======================
 # LOGGING
 # ======================
@@ -28,13 +56,9 @@ def osrm_route(from_coord: Tuple[float, float], to_coord: Tuple[float, float]) -
     params = {
         "overview": "false",
     }
-    headers = {
-        "Accept": "application/json",
-        "User-Agent": USER_AGENT,  # not required by OSRM demo but harmless
-    }
 
     try:
-        resp = requests.get(url, params=params, headers=headers, timeout=12)
+        resp = _SESSION.get(url, params=params, timeout=(3.05, 9))
         resp.raise_for_status()
         data = resp.json()
 
@@ -74,15 +98,11 @@ def build_osm_directions_link(from_coord: Tuple[float, float], to_coord: Tuple[f
     Build OSM directions link:
     https://www.openstreetmap.org/directions?engine=fossgis_osrm_car&route=lat1,lon1;lat2,lon2
     """
-    # TODO: implement
-    from_lat, from_lon = from_coord
-    to_lat, to_lon = to_coord
-
-    # Keep a reasonable precision for URLs
-    a = f"{from_lat:.6f},{from_lon:.6f}"
-    b = f"{to_lat:.6f},{to_lon:.6f}"
-
-    return f"https://www.openstreetmap.org/directions?engine=fossgis_osrm_car&route={a};{b}"
+    # Keep a reasonable precision for URLs (6 decimals ≈ 0.1m)
+    return (
+        "https://www.openstreetmap.org/directions?engine=fossgis_osrm_car&route="
+        f"{from_coord[0]:.6f},{from_coord[1]:.6f};{to_coord[0]:.6f},{to_coord[1]:.6f}"
+    )
 
 
 # ======================